@@ -1,31 +1,344 @@
+import asyncio
+import contextlib
+import functools
 import importlib
 import logging
 import json
 import os
 import re
+import threading
 import time
 
-from web3 import Web3
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from eth_hash.auto import keccak
+import httpx
+import websockets
+from websockets.exceptions import WebSocketException
+from web3 import Web3, WebsocketProvider
+from web3.middleware.exception_retry_request import check_if_retry_on_failure
+from web3.providers.base import JSONBaseProvider
 import web3.exceptions
 
 from django.conf import settings
+from django.db import transaction as db_transaction
 from rest_framework.exceptions import ValidationError
-from tenacity import retry, stop_after_attempt, wait_fixed
+from tenacity import (
+    Retrying,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential,
+)
 
-from .models import Block
-from .provider import BaseProvider
+from .models import Account, Block
+from .provider import BaseProvider, short_args
 
 
 logger = logging.getLogger('djblockchain.ethereum')
 
-SETTINGS = dict(ETHEREUM_CONTRACTS='')
+SETTINGS = dict(
+    ETHEREUM_CONTRACTS='',
+    # seconds between two polls of the node while watching a transaction
+    POLL_LATENCY=1,
+    # seconds to wait for a transaction receipt before failing the watch
+    RECEIPT_TIMEOUT=300,
+)
 SETTINGS.update(getattr(settings, 'DJBLOCKCHAIN', {}))
 
+# extract the revert message from the bytes repr of a failed call
+CALL_ERROR_RE = re.compile(r".*b'([\\]x[0-9a-z]{2,3} ?)+(?P<msg>[^\\]+)")
+
+# lowercased send errors of geth, Parity/OpenEthereum, Besu and Nethermind
+# when the node already has the transaction, ie. a previous attempt reached it
+KNOWN_TRANSACTION_ERRORS = (
+    'already known',
+    'alreadyknown',
+    'already imported',
+    'known transaction',
+    'known_transaction',
+)
+
+# lowercased send errors when the nonce was already used on chain
+NONCE_TOO_LOW_ERRORS = (
+    'nonce too low',
+    'nonce is too low',
+    'nonce_too_low',
+    'oldnonce',
+)
+
+# errors after which sending the same raw transaction again is safe
+TRANSPORT_ERRORS = (
+    asyncio.TimeoutError,
+    httpx.TransportError,
+    OSError,
+    WebSocketException,
+)
+
+# httpx client options, HTTP/2 multiplexes concurrent RPC calls over a single
+# connection when the h2 package is installed
+HTTP_OPTIONS = dict(
+    http2=h2 is not None,
+    limits=httpx.Limits(max_connections=32),
+    timeout=60,
+)
+
+# one Web3 client per endpoint, so that RPC calls reuse the same HTTP session
+# and keep-alive connections instead of opening a new socket each time
+_CLIENTS = dict()
+_SESSIONS = dict()
+
+
+def get_session(endpoint):
+    if endpoint not in _SESSIONS:
+        _SESSIONS[endpoint] = httpx.Client(**HTTP_OPTIONS)
+    return _SESSIONS[endpoint]
+
+
+class HTTPXProvider(JSONBaseProvider):
+    """
+    Web3 HTTP provider on top of an httpx client.
+
+    Replaces the retry middleware of web3's HTTPProvider, which only knows
+    about requests exceptions: calls to methods web3 considers safe to retry
+    are retried on httpx transport errors, except eth_sendRawTransaction.
+    """
+    retries = 5
+
+    def __init__(self, endpoint_uri, session):
+        self.endpoint_uri = endpoint_uri
+        self.session = session
+        super().__init__()
+
+    def make_request(self, method, params):
+        # sends are only retried by Provider._send_raw(), which knows when
+        # a previous attempt reached the node
+        retry = (
+            check_if_retry_on_failure(method)
+            and method != 'eth_sendRawTransaction'
+        )
+        retries = self.retries if retry else 1
+        request = self.encode_rpc_request(method, params)
+        for attempt in range(retries):
+            try:
+                response = self.session.post(
+                    self.endpoint_uri,
+                    content=request,
+                    headers={'Content-Type': 'application/json'},
+                )
+            except httpx.TransportError:
+                if attempt == retries - 1:
+                    raise
+            else:
+                break
+        response.raise_for_status()
+        return self.decode_rpc_response(response.content)
+
+
+class LockedWebsocketProvider(WebsocketProvider):
+    """
+    Web3 websocket provider with calls serialized on its shared connection.
+
+    make_request() sends then receives on a single socket without matching
+    response ids, so concurrent calls, ie. from the executor threads of
+    async_batch_responses(), would otherwise cross their responses.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+
+    def make_request(self, method, params):
+        with self.lock:
+            return super().make_request(method, params)
+
+
+def is_websocket(endpoint):
+    return endpoint.startswith(('ws://', 'wss://'))
+
+
+def get_client(endpoint):
+    if endpoint not in _CLIENTS:
+        if is_websocket(endpoint):
+            # a single persistent connection per process for all RPC calls,
+            # without HTTP fallback: the endpoint is the only node URL known
+            provider = LockedWebsocketProvider(
+                endpoint,
+                websocket_timeout=60,
+            )
+        else:
+            provider = HTTPXProvider(endpoint, get_session(endpoint))
+        _CLIENTS[endpoint] = Web3(provider)
+    return _CLIENTS[endpoint]
+
+
+def node_error(error, messages):
+    """Return True if a node error matches one of the messages."""
+    error = str(error).lower()
+    return any(message in error for message in messages)
+
+
+def has_float(data):
+    """Return True if a float is nested in data decoded from JSON."""
+    if isinstance(data, float):
+        return True
+    if isinstance(data, dict):
+        data = data.values()
+    elif not isinstance(data, list):
+        return False
+    return any(has_float(value) for value in data)
+
+
+@functools.lru_cache(maxsize=None)
+def load_contract_data(path):
+    if orjson:
+        # much faster on large ABI and bytecode files
+        with open(path, 'rb') as f:
+            content = f.read()
+        data = orjson.loads(content)
+        # orjson decodes integers beyond 64 bits as floats, losing precision
+        if not has_float(data):
+            return data
+        return json.loads(content)
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+# (endpoint, contract_name) -> Contract class, with the ABI parsed once
+_CONTRACT_CLASSES = dict()
+
+# (endpoint, contract_name, contract_address) -> (Contract, functions by name)
+_CONTRACTS = dict()
+
+# (contract_name, function_name) -> indexes of bytes32 inputs
+_BYTES32_INPUTS = dict()
+
+# (contract_name, function_name) -> (output names, output is bytes32 mask)
+_OUTPUTS = dict()
+
+
+def batch_payload(calls):
+    return [
+        dict(jsonrpc='2.0', id=i, method=method, params=params)
+        for i, (method, params) in enumerate(calls)
+    ]
+
+
+def batch_sort(calls, responses):
+    """Return the batch response of each call, in the same order as calls."""
+    if not isinstance(responses, list):
+        raise ValueError(f'Expected a JSON-RPC batch response: {responses}')
+    responses = {r.get('id'): r for r in responses}
+    return [responses[i] for i in range(len(calls))]
+
+
+def batch_results(responses):
+    """Return the results of sorted batch responses, raise on any error."""
+    results = []
+    for response in responses:
+        if 'error' in response:
+            raise ValueError(response['error'])
+        results.append(response['result'])
+    return results
+
+
+# errors after which waiting on a newHeads subscription falls back to polling
+SUBSCRIPTION_ERRORS = (
+    asyncio.TimeoutError,
+    OSError,
+    RuntimeError,
+    ValueError,
+    WebSocketException,
+)
+
+
+class NewHeads:
+    """
+    A newHeads subscription shared by the coroutines of an event loop.
+
+    A single websocket receives the block heads pushed by the node, and
+    next() wakes up every coroutine waiting for a new block.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.block_number = None
+        self.error = None
+
+    async def __aenter__(self):
+        self.ws = await websockets.connect(self.endpoint)
+        try:
+            await self.ws.send(json.dumps(
+                batch_payload([('eth_subscribe', ['newHeads'])])[0]
+            ))
+            subscription = json.loads(await self.ws.recv())
+            if 'error' in subscription:
+                raise ValueError(subscription['error'])
+        except BaseException:
+            await self.ws.close()
+            raise
+        self.condition = asyncio.Condition()
+        self.task = asyncio.ensure_future(self.receive())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.task.cancel()
+        await self.ws.close()
+
+    async def receive(self):
+        try:
+            async for message in self.ws:
+                head = json.loads(message)
+                if 'params' not in head:
+                    continue
+                async with self.condition:
+                    self.block_number = head['params']['result']['number']
+                    self.condition.notify_all()
+        except SUBSCRIPTION_ERRORS as e:
+            self.error = e
+        async with self.condition:
+            if not self.error:
+                self.error = WebSocketException('newHeads subscription closed')
+            self.condition.notify_all()
+
+    async def next(self, timeout):
+        """Return the block number of the next head pushed by the node."""
+        async with self.condition:
+            block_number = self.block_number
+            await asyncio.wait_for(
+                self.condition.wait_for(
+                    lambda: self.error or self.block_number != block_number
+                ),
+                timeout,
+            )
+            if self.error:
+                raise self.error
+            return self.block_number
+
+
+def hexstr_to_bytes(value):
+    if value[:2] in ('0x', '0X'):
+        value = value[2:]
+    if len(value) % 2:
+        value = '0' + value
+    return bytes.fromhex(value)
+
 
 class Provider(BaseProvider):
+    # eth_sendRawTransaction attempts on transport errors
+    send_attempts = 5
+    send_wait = wait_exponential(min=0.5, max=8)
+
     @property
     def client(self):
-        return Web3(Web3.HTTPProvider(self.blockchain.endpoint))
+        return get_client(self.blockchain.endpoint)
 
     def create_wallet(self, passphrase):
         acct = self.client.eth.account.create(passphrase)
@@ -43,8 +356,104 @@ class Provider(BaseProvider):
         )
 
     def get_contract_data(self, contract_name):
-        with open(self.get_contract_path(contract_name), 'r') as f:
-            return json.load(f)
+        return load_contract_data(self.get_contract_path(contract_name))
+
+    def get_contract_class(self, contract_name):
+        key = (self.blockchain.endpoint, contract_name)
+        if key not in _CONTRACT_CLASSES:
+            data = self.get_contract_data(contract_name)
+            _CONTRACT_CLASSES[key] = self.client.eth.contract(
+                abi=data['abi'],
+                bytecode=data.get('bytecode'),
+            )
+        return _CONTRACT_CLASSES[key]
+
+    def get_contract(self, contract_name, contract_address):
+        key = (self.blockchain.endpoint, contract_name, contract_address)
+        if key not in _CONTRACTS:
+            Contract = self.get_contract_class(contract_name)(  # noqa
+                address=contract_address,
+            )
+            functions = dict()
+            for func in Contract.all_functions():
+                # keep the first overload like find_functions_by_name()[0]
+                functions.setdefault(func.abi['name'], func)
+            _CONTRACTS[key] = (Contract, functions)
+        return _CONTRACTS[key]
+
+    def get_function(self, contract_name, contract_address, function_name):
+        Contract, functions = self.get_contract(  # noqa
+            contract_name,
+            contract_address,
+        )
+        if function_name not in functions:
+            raise Exception(f'{function_name} not found in {contract_name}')
+        return functions[function_name]
+
+    def batch_responses(self, *calls):
+        """
+        Send several (method, params) RPC calls in a single HTTP request.
+
+        Return the raw JSON-RPC response of each call, in the same order as
+        calls. Nodes or proxies which reject batches get one request per call.
+        """
+        if is_websocket(self.blockchain.endpoint):
+            # calls are cheap on the already open connection
+            responses = [
+                dict(self.client.provider.make_request(method, params), id=i)
+                for i, (method, params) in enumerate(calls)
+            ]
+            return batch_sort(calls, responses)
+
+        session = get_session(self.blockchain.endpoint)
+        response = session.post(
+            self.blockchain.endpoint,
+            json=batch_payload(calls),
+        )
+        response.raise_for_status()
+        responses = response.json()
+        if not isinstance(responses, list):
+            logger.info('%s: batch rejected: %s', self.blockchain, responses)
+            responses = []
+            for payload in batch_payload(calls):
+                response = session.post(self.blockchain.endpoint, json=payload)
+                response.raise_for_status()
+                responses.append(response.json())
+        return batch_sort(calls, responses)
+
+    def batch_request(self, *calls):
+        """Return the results of batch_responses(), raise on any error."""
+        return batch_results(self.batch_responses(*calls))
+
+    async def async_batch_responses(self, http, *calls):
+        """Coroutine version of batch_responses() using an httpx client."""
+        if is_websocket(self.blockchain.endpoint):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None,
+                functools.partial(self.batch_responses, *calls),
+            )
+        response = await http.post(
+            self.blockchain.endpoint,
+            json=batch_payload(calls),
+        )
+        response.raise_for_status()
+        responses = response.json()
+        if not isinstance(responses, list):
+            logger.info('%s: batch rejected: %s', self.blockchain, responses)
+            responses = []
+            for payload in batch_payload(calls):
+                response = await http.post(
+                    self.blockchain.endpoint,
+                    json=payload,
+                )
+                response.raise_for_status()
+                responses.append(response.json())
+        return batch_sort(calls, responses)
+
+    async def async_batch_request(self, http, *calls):
+        """Coroutine version of batch_request() using an httpx client."""
+        return batch_results(await self.async_batch_responses(http, *calls))
 
     def send(self,
              sender,
@@ -52,27 +461,27 @@ class Provider(BaseProvider):
              contract_name,
              contract_address,
              function_name,
-             *args):
+             *args,
+             gas=None):
 
-        logger.debug(f'{contract_name}.{function_name}({args}): start')
+        logger.debug('%s.%s(%r): start', contract_name, function_name, args)
 
-        data = self.get_contract_data(contract_name)
-        Contract = self.client.eth.contract(  # noqa
-            abi=data['abi'],
-            address=contract_address,
+        func = self.get_function(
+            contract_name,
+            contract_address,
+            function_name,
         )
-        funcs = Contract.find_functions_by_name(function_name)
-        if not funcs:
-            raise Exception(f'{function_name} not found in {contract_name}')
 
-        func = funcs[0]
+        key = (contract_name, function_name)
+        if key not in _BYTES32_INPUTS:
+            _BYTES32_INPUTS[key] = [
+                i for i, inp in enumerate(func.abi.get('inputs', []))
+                if inp['type'].startswith('bytes32')
+            ]
 
         args = list(args)
-
-
-        for i, inp in enumerate(func.abi.get('inputs', [])):
-            if inp['type'].startswith('bytes32'):
-                args[i] = self.client.toBytes(hexstr=args[i])
+        for i in _BYTES32_INPUTS[key]:
+            args[i] = hexstr_to_bytes(args[i])
 
         tx = func(*args)
 
@@ -80,87 +489,355 @@ class Provider(BaseProvider):
             sender,
             private_key,
             tx,
+            gas=gas,
         )
 
-        logger.info(f'{contract_name}.{function_name}({args}): {result}')
+        logger.info(
+            '%s.%s(%r): %s', contract_name, function_name, args, result)
 
         return result
 
-    def deploy(self, sender, private_key, contract_name, *args):
-        logger.debug(f'{contract_name}.deploy({args}): start')
+    def deploy(self, sender, private_key, contract_name, *args, gas=None):
+        logger.debug('%s.deploy(%r): start', contract_name, short_args(args))
 
-        data = self.get_contract_data(contract_name)
+        Contract = self.get_contract_class(contract_name)  # noqa
+        tx = Contract.constructor(*args)
+        result = self.write_transaction(sender, private_key, tx, gas=gas)
+        logger.info(
+            '%s.deploy(%r): %s', contract_name, short_args(args), result)
+        return result
 
-        Contract = self.client.eth.contract(  # noqa
-            abi=data['abi'],
-            bytecode=data['bytecode']
+    def allocate_nonce(self, sender):
+        """
+        Return the next nonce of sender and increment Account.next_nonce.
+
+        The node is only asked for the transaction count when the counter is
+        not set yet, or was reset by release_nonce() after a failed send or a
+        watch timeout. As such, the account must not send transactions
+        outside of djblockchain, or the counter gets behind the chain.
+        """
+        accounts = Account.objects.filter(
+            blockchain=self.blockchain,
+            address=sender,
         )
+        with db_transaction.atomic():
+            account = accounts.select_for_update().first()
+            if account and account.next_nonce is not None:
+                nonce = account.next_nonce
+            else:
+                nonce = self.client.eth.getTransactionCount(sender, 'pending')
+            accounts.update(next_nonce=nonce + 1)
+        return nonce
 
-        tx = Contract.constructor(*args)
-        result = self.write_transaction(sender, private_key, tx)
-        logger.info(f'{contract_name}.deploy({args}): {result}')
-        return result
+    def release_nonce(self, sender):
+        """Resynchronize the nonce of sender from the node next time."""
+        Account.objects.filter(
+            blockchain=self.blockchain,
+            address=sender,
+        ).update(next_nonce=None)
 
-    @retry(wait=wait_fixed(2), reraise=True, stop=stop_after_attempt(7))
-    def write_transaction(self, sender, private_key, tx):
-        nonce = self.client.eth.getTransactionCount(sender)
-        options = {
+    def prepare_transaction(self, sender, tx, nonce):
+        """Return the transaction dict for tx, without gas."""
+        # a gas value prevents buildTransaction() from estimating it
+        built = tx.buildTransaction({
             'from': sender,
             'nonce': nonce,
-        }
-        options['gas'] = self.client.eth.estimateGas(tx.buildTransaction(options))
-        built = tx.buildTransaction(options)
-        signed_txn = self.client.eth.account.sign_transaction(
-            built,
-            private_key=private_key
-        )
-
-        self.client.eth.sendRawTransaction(signed_txn.rawTransaction)
-        return self.client.toHex(
-            self.client.keccak(signed_txn.rawTransaction)
-        )
+            'gas': 0,
+        })
+        del built['gas']
+        return built
+
+    def sign_transaction(self, sender, private_key, tx, gas=None):
+        """Allocate a nonce, estimate gas and sign tx for sender."""
+        nonce = self.allocate_nonce(sender)
+        try:
+            built = self.prepare_transaction(sender, tx, nonce)
+            built['gas'] = gas or self.client.eth.estimateGas(built)
+            return self.client.eth.account.sign_transaction(
+                built,
+                private_key=private_key
+            )
+        except Exception:
+            # the nonce was not consumed on chain
+            self.release_nonce(sender)
+            raise
+
+    def transaction_hash(self, signed_txn):
+        return '0x' + keccak(signed_txn.rawTransaction).hex()
+
+    def _send_raw(self, signed_txn):
+        for attempt in Retrying(
+            retry=retry_if_exception_type(TRANSPORT_ERRORS),
+            wait=self.send_wait,
+            reraise=True,
+            stop=stop_after_attempt(self.send_attempts),
+        ):
+            with attempt:
+                try:
+                    # bypass web3 send wrappers which may poll for the
+                    # receipt, the hash is computed locally and the receipt
+                    # is waited for in watch()
+                    self.client.manager.request_blocking(
+                        'eth_sendRawTransaction',
+                        [signed_txn.rawTransaction.hex()],
+                    )
+                except ValueError as e:
+                    if node_error(e, KNOWN_TRANSACTION_ERRORS):
+                        # a previous attempt reached the node before failing
+                        return
+                    if (
+                        attempt.retry_state.attempt_number > 1
+                        and node_error(e, NONCE_TOO_LOW_ERRORS)
+                    ):
+                        # a previous attempt may have been mined meanwhile,
+                        # return its hash and let watch() settle it
+                        return
+                    raise
+
+    def write_transaction(self, sender, private_key, tx, gas=None):
+        signed_txn = self.sign_transaction(sender, private_key, tx, gas=gas)
+        try:
+            try:
+                self._send_raw(signed_txn)
+            except ValueError as e:
+                if not node_error(e, NONCE_TOO_LOW_ERRORS):
+                    raise
+                # rejected on the first attempt: the counter is behind the
+                # chain, sign again with its nonce
+                self.release_nonce(sender)
+                signed_txn = self.sign_transaction(
+                    sender,
+                    private_key,
+                    tx,
+                    gas=gas,
+                )
+                self._send_raw(signed_txn)
+        except Exception:
+            self.release_nonce(sender)
+            raise
+        return self.transaction_hash(signed_txn)
+
+    def write_transactions(self, txs):
+        """
+        Sign and send a list of (sender, private_key, tx) in one RPC batch.
+
+        Return, in the same order as txs, the transaction hash of each
+        transaction accepted by the node, or the ValueError it was rejected
+        with, so that accepted hashes are never lost on partial failure.
+        """
+        senders = set()
+        signed_txns = []
+        try:
+            for sender, private_key, tx in txs:
+                senders.add(sender)
+                signed_txns.append(
+                    self.sign_transaction(sender, private_key, tx)
+                )
+            responses = self.batch_responses(*[
+                ('eth_sendRawTransaction', [signed.rawTransaction.hex()])
+                for signed in signed_txns
+            ])
+        except Exception:
+            # none of the allocated nonces were consumed on chain
+            for sender in senders:
+                self.release_nonce(sender)
+            raise
+
+        results = []
+        failed = set()
+        for (sender, private_key, tx), signed, response in zip(
+            txs, signed_txns, responses
+        ):
+            if 'error' in response and not node_error(
+                response['error'],
+                KNOWN_TRANSACTION_ERRORS,
+            ):
+                failed.add(sender)
+                results.append(ValueError(response['error']))
+            else:
+                results.append(self.transaction_hash(signed))
+        for sender in failed:
+            self.release_nonce(sender)
+        return results
+
+    def is_confirmed(self, receipt, block_number):
+        """Return True if a raw receipt has enough confirmation blocks."""
+        # the receipt block may also change on chain reorg
+        if not receipt or not receipt['blockNumber']:
+            return False
+        confirmations = int(block_number, 16) - int(receipt['blockNumber'], 16)
+        return confirmations >= self.blockchain.confirmation_blocks
+
+    def check_deadline(self, txhash, receipt, deadline):
+        if not receipt and time.monotonic() > deadline:
+            raise web3.exceptions.TimeExhausted(
+                f'{txhash} not in chain after '
+                f'{SETTINGS["RECEIPT_TIMEOUT"]} seconds'
+            )
 
-    def watch(self, transaction):
-        func = transaction.function or 'deploy'
-        sign = (
-            f'{transaction.contract_name}.{func}(*{transaction.args})'
+    async def wait_receipt(self, http, txhash, heads=None):
+        """
+        Return the raw receipt of txhash once it has enough confirmations.
+
+        Waiting is done with asyncio, so that many transactions can be waited
+        for concurrently in a single event loop, on the shared NewHeads
+        subscription if any.
+        """
+        deadline = time.monotonic() + SETTINGS['RECEIPT_TIMEOUT']
+        if heads:
+            try:
+                return await self.subscribe_receipt(
+                    http,
+                    txhash,
+                    heads,
+                    deadline,
+                )
+            except SUBSCRIPTION_ERRORS as e:
+                logger.info(
+                    '%s: newHeads subscription failed, polling: %s',
+                    self.blockchain,
+                    e,
+                )
+        return await self.poll_receipt(http, txhash, deadline)
+
+    async def poll_receipt(self, http, txhash, deadline):
+        while True:
+            receipt, block_number = await self.async_batch_request(
+                http,
+                ('eth_getTransactionReceipt', [txhash]),
+                ('eth_blockNumber', []),
+            )
+            if self.is_confirmed(receipt, block_number):
+                return receipt
+            self.check_deadline(txhash, receipt, deadline)
+            await asyncio.sleep(SETTINGS['POLL_LATENCY'])
+
+    async def subscribe_receipt(self, http, txhash, heads, deadline):
+        """
+        Wait for the receipt with block heads pushed by the node.
+
+        The receipt is only requested again when a new head could change the
+        result, instead of polling both every POLL_LATENCY seconds.
+        """
+        receipt, block_number = await self.async_batch_request(
+            http,
+            ('eth_getTransactionReceipt', [txhash]),
+            ('eth_blockNumber', []),
         )
-        logger.debug(f'{sign}: watch')
-        receipt = self.client.eth.waitForTransactionReceipt(
-            transaction.txhash,
-            3600 * 24
+        while not self.is_confirmed(receipt, block_number):
+            self.check_deadline(txhash, receipt, deadline)
+            try:
+                block_number = await heads.next(
+                    max(deadline - time.monotonic(), 0) if not receipt
+                    else SETTINGS['RECEIPT_TIMEOUT']
+                )
+            except asyncio.TimeoutError:
+                if receipt:
+                    raise
+                # check_deadline() raises now
+                continue
+            if not receipt or self.is_confirmed(receipt, block_number):
+                # fetch it again, its block may have changed on reorg
+                receipt, = await self.async_batch_request(
+                    http,
+                    ('eth_getTransactionReceipt', [txhash]),
+                )
+        return receipt
+
+    async def poll_receipts(self, http, txhashes):
+        """
+        Return the latest block number and a dict of txhash: raw receipt.
+
+        A receipt is None while not in chain, or the ValueError returned by
+        the node for it. All receipts and the block number are fetched in a
+        single batch.
+        """
+        *receipts, block_number = await self.async_batch_responses(
+            http,
+            *[('eth_getTransactionReceipt', [txhash]) for txhash in txhashes],
+            ('eth_blockNumber', []),
         )
+        block_number, = batch_results([block_number])
+        return block_number, {
+            txhash: (
+                ValueError(receipt['error']) if 'error' in receipt
+                else receipt['result']
+            )
+            for txhash, receipt in zip(txhashes, receipts)
+        }
 
-        block_number = self.client.eth.blockNumber
-        receipt_block_number = receipt['blockNumber']
-
-        while block_number - receipt_block_number < self.blockchain.confirmation_blocks:
-            receipt = self.client.eth.waitForTransactionReceipt(
-                transaction.txhash,
-                3600 * 24
+    async def async_watch_many(self, transactions):
+        async with contextlib.AsyncExitStack() as stack:
+            http = await stack.enter_async_context(
+                httpx.AsyncClient(**HTTP_OPTIONS)
+            )
+            heads = None
+            if is_websocket(self.blockchain.endpoint):
+                try:
+                    heads = await stack.enter_async_context(
+                        NewHeads(self.blockchain.endpoint)
+                    )
+                except SUBSCRIPTION_ERRORS as e:
+                    logger.info(
+                        '%s: newHeads subscription failed, polling: %s',
+                        self.blockchain,
+                        e,
+                    )
+            return await asyncio.gather(
+                *[
+                    self.wait_receipt(http, transaction.txhash, heads)
+                    for transaction in transactions
+                ],
+                return_exceptions=True,
             )
-            block_number = self.client.eth.blockNumber
-            receipt_block_number = receipt['blockNumber']
-            time.sleep(5)
 
-        transaction.gas = receipt['gasUsed']
+    def watch_receipt(self, transaction, receipt):
+        """Update transaction with a raw receipt from wait_receipt()."""
+        transaction.gas = int(receipt['gasUsed'], 16)
         transaction.block = Block.objects.get_or_create(
             blockchain=self.blockchain,
-            number=receipt['blockNumber'],
+            number=int(receipt['blockNumber'], 16),
         )[0]
-        if receipt.contractAddress:
-            transaction.contract_address = receipt.contractAddress
-
-    def call(self, contract_name, contract_address, function, *args):
-        # supported by ethereum only
-        data = self.get_contract_data(contract_name)
+        if receipt['contractAddress']:
+            transaction.contract_address = Web3.toChecksumAddress(
+                receipt['contractAddress']
+            )
 
-        Contract = self.client.eth.contract(  # noqa
-            abi=data['abi'],
-            address=contract_address,
+    def watch(self, transaction):
+        logger.debug(
+            '%s.%s(*%r): watch',
+            transaction.contract_name,
+            transaction.function or 'deploy',
+            transaction.args,
         )
+        error, = self.watch_many([transaction])
+        if error:
+            raise error
+
+    def watch_many(self, transactions):
+        """
+        Watch transactions concurrently, in a single event loop.
+
+        Total wait is the slowest receipt rather than the sum of all. Return
+        the exception raised for each transaction, or None on success: saving
+        the transactions is up to the caller.
+        """
+        receipts = asyncio.run(self.async_watch_many(transactions))
+        errors = []
+        for transaction, receipt in zip(transactions, receipts):
+            if isinstance(receipt, Exception):
+                if isinstance(receipt, web3.exceptions.TimeExhausted):
+                    # it was dropped, the counter may be ahead of the chain
+                    self.release_nonce(transaction.sender.address)
+                errors.append(receipt)
+            else:
+                self.watch_receipt(transaction, receipt)
+                errors.append(None)
+        return errors
 
-        func = Contract.find_functions_by_name(function)[0]
+    def call(self, contract_name, contract_address, function, *args):
+        # supported by ethereum only
+        func = self.get_function(contract_name, contract_address, function)
 
         try:
             result = func(*args).call()
@@ -191,28 +868,31 @@ class Provider(BaseProvider):
             # in one case whilst testing locally :
             #    e was "BadFunctionCallOutput('Could not transact with/call contract function,
             #    is contract deployed correctly and chain synced?')"
-            msg = re.match(  # noqa
-                ".*b'([\\\]x[0-9a-z]{2,3} ?)+(?P<msg>[^\\\]+)",  # noqa
-                e.args[0]
-            )
+            msg = CALL_ERROR_RE.match(e.args[0])
             if not msg:
                 raise Exception(e.args[0])
             else:
                 raise Exception(msg.group('msg'))
             # raise Exception(e.args[0])
 
+        key = (contract_name, function)
+        if key not in _OUTPUTS:
+            _OUTPUTS[key] = (
+                tuple(out['name'] for out in func.abi['outputs']),
+                tuple(
+                    out['type'].startswith('bytes32')
+                    for out in func.abi['outputs']
+                ),
+            )
+        names, bytes32_mask = _OUTPUTS[key]
+
         # value returned is either a single value
-        if len(func.abi['outputs']) == 1:
-            if func.abi['outputs'][0]['type'].startswith('bytes32'):
-                return result.hex()
-            return result
+        if len(names) == 1:
+            return result.hex() if bytes32_mask[0] else result
 
         # or an object
         # https://sft-protocol.readthedocs.io/en/latest/kyc.html#KYCBase.getInvestor
-        output = {}
-        for i, out in enumerate(func.abi['outputs']):
-            if out['type'].startswith('bytes32'):
-                output[out['name']] = result[i].hex()
-            else:
-                output[out['name']] = result[i]
-        return output
+        return {
+            name: value.hex() if is_bytes32 else value
+            for name, is_bytes32, value in zip(names, bytes32_mask, result)
+        }
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+
+import httpx
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djblockchain.ethereum import HTTP_OPTIONS, SETTINGS
+from djblockchain import models
+from djblockchain.models import Transaction
+
+logger = logging.getLogger('djblockchain')
+
+
+class Command(BaseCommand):
+    help = (
+        'Watch the pending transactions of all senders in a single process,'
+        ' requires DJBLOCKCHAIN["WATCHER"] = True'
+    )
+
+    def handle(self, *args, **options):
+        if not models.SETTINGS['WATCHER']:
+            # the spooler would also watch the same transactions
+            raise CommandError('Requires DJBLOCKCHAIN["WATCHER"] = True')
+        while True:
+            self.tick()
+            time.sleep(SETTINGS['POLL_LATENCY'])
+
+    def pending(self):
+        """Return a list of (provider, transactions) per blockchain."""
+        transactions = Transaction.objects.filter(
+            state__in=('watch', 'watching'),
+            error='',
+            txhash__isnull=False,
+        ).select_related('sender__blockchain').select_subclasses()
+
+        pending = dict()
+        for transaction in transactions:
+            blockchain = transaction.sender.blockchain
+            if blockchain.pk not in pending:
+                pending[blockchain.pk] = (blockchain.provider, [])
+            pending[blockchain.pk][1].append(transaction)
+
+        return [
+            (provider, transactions)
+            for provider, transactions in pending.values()
+            if hasattr(provider, 'poll_receipts')
+        ]
+
+    async def poll(self, pending):
+        async with httpx.AsyncClient(**HTTP_OPTIONS) as http:
+            return await asyncio.gather(
+                *[
+                    provider.poll_receipts(
+                        http,
+                        [transaction.txhash for transaction in transactions],
+                    )
+                    for provider, transactions in pending
+                ],
+                return_exceptions=True,
+            )
+
+    def timed_out(self, transaction):
+        """Return True if transaction is in watch since RECEIPT_TIMEOUT."""
+        watched = [
+            timestamp for state, timestamp in transaction.history
+            if state == 'watch'
+        ]
+        if not watched:
+            return False
+        return time.time() - max(watched) > SETTINGS['RECEIPT_TIMEOUT']
+
+    def fail(self, provider, transaction, error):
+        logger.error(f'Tx({transaction}) watch failed: {error}')
+        if hasattr(provider, 'release_nonce'):
+            # it was dropped, the counter may be ahead of the chain
+            provider.release_nonce(transaction.sender.address)
+        # like the spooler watch_state() errors, stops the sender's queue,
+        # update() because save() raises when error is set
+        Transaction.objects.filter(pk=transaction.pk).update(error=error)
+
+    def tick(self):
+        pending = self.pending()
+        if not pending:
+            return
+
+        results = asyncio.run(self.poll(pending))
+
+        for (provider, transactions), result in zip(pending, results):
+            if isinstance(result, Exception):
+                # one failing node should not block the other blockchains
+                logger.error(f'{provider.blockchain} poll failed: {result}')
+                continue
+
+            block_number, receipts = result
+            for transaction in transactions:
+                receipt = receipts[transaction.txhash]
+                if isinstance(receipt, Exception):
+                    # retried on next tick without blocking the others
+                    logger.error(f'Tx({transaction}) poll failed: {receipt}')
+                elif provider.is_confirmed(receipt, block_number):
+                    provider.watch_receipt(transaction, receipt)
+                    # saving spools the sender, which runs postdeploy
+                    transaction.state_set('postdeploy')
+                elif not receipt and self.timed_out(transaction):
+                    self.fail(
+                        provider,
+                        transaction,
+                        f'{transaction.txhash} not in chain after '
+                        f'{SETTINGS["RECEIPT_TIMEOUT"]} seconds',
+                    )
+                elif transaction.state == 'watch':
+                    transaction.state_set('watching')
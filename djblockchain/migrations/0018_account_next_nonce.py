@@ -0,0 +1,18 @@
+# Generated by Django 3.1.4 on 2026-10-14 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djblockchain', '0017_jsonfield'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='next_nonce',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -40,7 +40,10 @@ SETTINGS = dict(
         ('djblockchain.fake.Provider', 'Test'),
         ('djblockchain.fake.FailDeploy', 'Test that fails deploy'),
         ('djblockchain.fake.FailWatch', 'Test that fails watch'),
-    )
+    ),
+    # let the djblockchain_watch command watch transactions of providers
+    # which support it, instead of blocking the sender spooler
+    WATCHER=False,
 )
 SETTINGS.update(getattr(settings, 'DJBLOCKCHAIN', {}))
 
@@ -78,6 +81,11 @@ class Account(models.Model):
         on_delete=models.CASCADE,
     )
     crypted_key = models.BinaryField()
+    next_nonce = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+    )
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         null=True,
@@ -142,6 +150,10 @@ def sender_queue(pk):
         tx.deploy_state()
 
     elif tx.state in ('watch', 'watching'):
+        if SETTINGS['WATCHER'] and hasattr(tx.provider, 'poll_receipts'):
+            # djblockchain_watch will save it in postdeploy and spool us
+            logger.info(f'Transaction {tx} is watched by djblockchain_watch')
+            return
         tx.watch_state()
 
     elif tx.state in ('postdeploy', 'postdeploying'):
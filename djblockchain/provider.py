@@ -1,3 +1,15 @@
+def short_args(args, size=64):
+    """Return args with long bytes or str values truncated, for logging."""
+    result = []
+    for arg in args:
+        if isinstance(arg, bytes) and len(arg) > size:
+            arg = arg[:size] + b'...'
+        elif isinstance(arg, str) and len(arg) > size:
+            arg = arg[:size] + '...'
+        result.append(arg)
+    return tuple(result)
+
+
 class BaseProvider:
     def __init__(self, blockchain):
         self.blockchain = blockchain
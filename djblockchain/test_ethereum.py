@@ -0,0 +1,366 @@
+from concurrent import futures
+import time
+from unittest import mock
+
+import pytest
+
+pytest.importorskip('web3')
+
+from hexbytes import HexBytes
+
+from . import ethereum
+from .models import Account, Blockchain, Transaction
+
+
+ENDPOINT = 'http://testnode:8545'
+SENDER = '0x' + 'a' * 40
+
+
+@pytest.fixture
+def bc():
+    return Blockchain.objects.create(
+        name='ethtest',
+        provider_class='djblockchain.ethereum.Provider',
+        endpoint=ENDPOINT,
+        confirmation_blocks=2,
+    )
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = mock.Mock()
+    client.eth.getTransactionCount.return_value = 5
+    client.eth.estimateGas.return_value = 21000
+    client.eth.account.sign_transaction.side_effect = (
+        lambda built, private_key: mock.Mock(
+            rawTransaction=HexBytes(bytes([built['nonce']])),
+        )
+    )
+    monkeypatch.setitem(ethereum._CLIENTS, ENDPOINT, client)
+    return client
+
+
+@pytest.fixture
+def provider(bc, client):
+    return bc.provider
+
+
+@pytest.fixture
+def acc(bc):
+    return Account.objects.create(blockchain=bc, address=SENDER)
+
+
+def tx():
+    tx = mock.Mock()
+    tx.buildTransaction.side_effect = lambda options: dict(options)
+    return tx
+
+
+def test_hexstr_to_bytes():
+    assert ethereum.hexstr_to_bytes('0x0102') == b'\x01\x02'
+    assert ethereum.hexstr_to_bytes('0X0102') == b'\x01\x02'
+    assert ethereum.hexstr_to_bytes('102') == b'\x01\x02'
+
+
+def test_batch_sort():
+    calls = [('eth_blockNumber', []), ('eth_chainId', [])]
+    responses = [dict(id=1, result='0x1'), dict(id=0, result='0x10')]
+    assert ethereum.batch_sort(calls, responses) == [
+        dict(id=0, result='0x10'),
+        dict(id=1, result='0x1'),
+    ]
+
+
+def test_batch_sort_not_a_batch():
+    with pytest.raises(ValueError):
+        ethereum.batch_sort(
+            [('eth_blockNumber', [])],
+            dict(id=None, error=dict(message='batch not supported')),
+        )
+
+
+def test_batch_results():
+    assert ethereum.batch_results([dict(result='0x1')]) == ['0x1']
+    with pytest.raises(ValueError):
+        ethereum.batch_results([dict(result='0x1'), dict(error='fail')])
+
+
+@pytest.mark.django_db
+def test_is_confirmed(provider):
+    assert not provider.is_confirmed(None, '0x10')
+    assert not provider.is_confirmed(dict(blockNumber=None), '0x10')
+    assert not provider.is_confirmed(dict(blockNumber='0xf'), '0x10')
+    assert provider.is_confirmed(dict(blockNumber='0xe'), '0x10')
+
+
+@pytest.mark.django_db
+def test_watch_receipt(provider, acc):
+    transaction = Transaction(sender=acc)
+    provider.watch_receipt(transaction, dict(
+        gasUsed='0x5208',
+        blockNumber='0x10',
+        contractAddress='0x' + 'b' * 40,
+    ))
+    assert transaction.gas == 21000
+    assert transaction.block.number == 16
+    assert transaction.block.blockchain == provider.blockchain
+    assert transaction.contract_address == (
+        ethereum.Web3.toChecksumAddress('0x' + 'b' * 40)
+    )
+
+
+@pytest.mark.django_db
+def test_allocate_nonce(provider, client, acc):
+    assert provider.allocate_nonce(SENDER) == 5
+    assert provider.allocate_nonce(SENDER) == 6
+    # the node is only asked once, then the counter is used
+    client.eth.getTransactionCount.assert_called_once_with(SENDER, 'pending')
+    acc.refresh_from_db()
+    assert acc.next_nonce == 7
+
+
+@pytest.mark.django_db
+def test_release_nonce(provider, client, acc):
+    provider.allocate_nonce(SENDER)
+    provider.release_nonce(SENDER)
+    acc.refresh_from_db()
+    assert acc.next_nonce is None
+
+    client.eth.getTransactionCount.return_value = 9
+    assert provider.allocate_nonce(SENDER) == 9
+    assert client.eth.getTransactionCount.call_count == 2
+
+
+@pytest.mark.django_db
+def test_watch_timeout_releases_nonce(provider, acc, monkeypatch):
+    Account.objects.filter(pk=acc.pk).update(next_nonce=12)
+
+    async def wait_receipt(http, txhash, *args, **kwargs):
+        raise ethereum.web3.exceptions.TimeExhausted('dropped')
+    monkeypatch.setattr(provider, 'wait_receipt', wait_receipt)
+
+    transaction = Transaction(sender=acc, txhash='0x1')
+    error, = provider.watch_many([transaction])
+    assert isinstance(error, ethereum.web3.exceptions.TimeExhausted)
+    acc.refresh_from_db()
+    assert acc.next_nonce is None
+
+
+OTHER = '0x' + 'c' * 40
+
+
+@pytest.mark.django_db
+def test_write_transactions(provider, client, acc, monkeypatch):
+    other = Account.objects.create(blockchain=acc.blockchain, address=OTHER)
+    monkeypatch.setattr(provider, 'batch_responses', lambda *calls: [
+        dict(id=0, result='0x1'),
+        dict(id=1, error=dict(message='insufficient funds')),
+    ])
+
+    first, second = provider.write_transactions([
+        (SENDER, b'key', tx()),
+        (OTHER, b'key', tx()),
+    ])
+    # accepted hash is returned despite the other failure
+    assert first == provider.transaction_hash(
+        mock.Mock(rawTransaction=HexBytes(b'\x05'))
+    )
+    assert isinstance(second, ValueError)
+
+    acc.refresh_from_db()
+    other.refresh_from_db()
+    assert acc.next_nonce == 6
+    assert other.next_nonce is None
+
+
+@pytest.mark.django_db
+def test_write_transactions_sign_failure(provider, client, acc):
+    other = Account.objects.create(blockchain=acc.blockchain, address=OTHER)
+    client.eth.estimateGas.side_effect = [21000, ValueError('reverted')]
+
+    with pytest.raises(ValueError):
+        provider.write_transactions([
+            (SENDER, b'key', tx()),
+            (OTHER, b'key', tx()),
+        ])
+
+    # the first sender nonce was allocated but never broadcast
+    acc.refresh_from_db()
+    other.refresh_from_db()
+    assert acc.next_nonce is None
+    assert other.next_nonce is None
+
+
+def test_httpx_provider_retries_transport_errors():
+    session = mock.Mock()
+    session.post.side_effect = [
+        ethereum.httpx.ConnectError('reset'),
+        mock.Mock(content=b'{"jsonrpc": "2.0", "id": 0, "result": "0x1"}'),
+    ]
+    provider = ethereum.HTTPXProvider(ENDPOINT, session)
+    assert provider.make_request('eth_blockNumber', [])['result'] == '0x1'
+    assert session.post.call_count == 2
+
+
+def test_httpx_provider_does_not_retry_send():
+    session = mock.Mock()
+    session.post.side_effect = ethereum.httpx.ConnectError('reset')
+    provider = ethereum.HTTPXProvider(ENDPOINT, session)
+    with pytest.raises(ethereum.httpx.ConnectError):
+        provider.make_request('eth_sendRawTransaction', ['0x01'])
+    assert session.post.call_count == 1
+
+
+def test_websocket_provider_serializes_calls(monkeypatch):
+    active = []
+    concurrency = []
+
+    def make_request(self, method, params):
+        active.append(method)
+        concurrency.append(len(active))
+        time.sleep(0.01)
+        active.remove(method)
+        return dict(result='0x1')
+    monkeypatch.setattr(ethereum.WebsocketProvider, 'make_request', make_request)
+
+    provider = ethereum.LockedWebsocketProvider('ws://testnode:8546')
+    with futures.ThreadPoolExecutor(4) as pool:
+        list(pool.map(
+            lambda i: provider.make_request('eth_blockNumber', []),
+            range(8),
+        ))
+    assert max(concurrency) == 1
+
+
+@pytest.mark.django_db
+def test_watch_many_shares_subscription(provider, acc, monkeypatch):
+    provider.blockchain.endpoint = 'ws://testnode:8546'
+    opened = []
+
+    class NewHeads:
+        def __init__(self, endpoint):
+            opened.append(endpoint)
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            pass
+    monkeypatch.setattr(ethereum, 'NewHeads', NewHeads)
+
+    waited = []
+
+    async def wait_receipt(http, txhash, heads=None):
+        waited.append(heads)
+        return dict(gasUsed='0x5208', blockNumber='0x10', contractAddress=None)
+    monkeypatch.setattr(provider, 'wait_receipt', wait_receipt)
+
+    provider.watch_many([
+        Transaction(sender=acc, txhash='0x1'),
+        Transaction(sender=acc, txhash='0x2'),
+    ])
+    assert opened == ['ws://testnode:8546']
+    assert len(waited) == 2 and waited[0] is waited[1]
+
+
+@pytest.mark.django_db
+def test_wait_receipt_fallback_keeps_deadline(provider, monkeypatch):
+    deadlines = []
+
+    async def subscribe_receipt(http, txhash, heads, deadline):
+        deadlines.append(deadline)
+        raise RuntimeError('connection lost')
+    monkeypatch.setattr(provider, 'subscribe_receipt', subscribe_receipt)
+
+    async def poll_receipt(http, txhash, deadline):
+        deadlines.append(deadline)
+    monkeypatch.setattr(provider, 'poll_receipt', poll_receipt)
+
+    ethereum.asyncio.run(provider.wait_receipt(None, '0x1', mock.Mock()))
+    # polling does not restart RECEIPT_TIMEOUT
+    subscribed, polled = deadlines
+    assert subscribed == polled
+
+
+def test_load_contract_data_big_int(tmp_path):
+    path = tmp_path / 'Big.json'
+    path.write_text('{"abi": [], "value": 123456789012345678901234567890}')
+    ethereum.load_contract_data.cache_clear()
+    data = ethereum.load_contract_data(str(path))
+    assert data['value'] == 123456789012345678901234567890
+
+
+@pytest.fixture
+def no_wait(monkeypatch):
+    import tenacity
+    monkeypatch.setattr(ethereum.Provider, 'send_wait', tenacity.wait_none())
+
+
+@pytest.mark.django_db
+def test_send_raw_retries_transport_errors(provider, client, no_wait):
+    client.manager.request_blocking.side_effect = [
+        ethereum.httpx.ConnectError('reset'),
+        '0x1',
+    ]
+    provider._send_raw(mock.Mock(rawTransaction=HexBytes(b'\x05')))
+    assert client.manager.request_blocking.call_count == 2
+
+
+@pytest.mark.django_db
+def test_send_raw_does_not_retry_rejection(provider, client, no_wait):
+    client.manager.request_blocking.side_effect = ValueError(
+        dict(message='insufficient funds for gas * price + value'),
+    )
+    with pytest.raises(ValueError):
+        provider._send_raw(mock.Mock(rawTransaction=HexBytes(b'\x05')))
+    assert client.manager.request_blocking.call_count == 1
+
+
+@pytest.mark.django_db
+def test_send_raw_known_transaction(provider, client, no_wait):
+    client.manager.request_blocking.side_effect = [
+        ethereum.httpx.ReadTimeout('timeout'),
+        ValueError(dict(
+            message='Transaction with the same hash was already imported.',
+        )),
+    ]
+    provider._send_raw(mock.Mock(rawTransaction=HexBytes(b'\x05')))
+    assert client.manager.request_blocking.call_count == 2
+
+
+@pytest.mark.django_db
+def test_write_transaction_nonce_too_low(provider, client, acc, no_wait):
+    client.manager.request_blocking.side_effect = [
+        ValueError(dict(message='nonce too low')),
+        '0x1',
+    ]
+    Account.objects.filter(pk=acc.pk).update(next_nonce=3)
+    client.eth.getTransactionCount.return_value = 7
+
+    txhash = provider.write_transaction(SENDER, b'key', tx())
+    # signed again with the nonce of the node
+    assert txhash == provider.transaction_hash(
+        mock.Mock(rawTransaction=HexBytes(b'\x07'))
+    )
+    acc.refresh_from_db()
+    assert acc.next_nonce == 8
+
+
+@pytest.mark.django_db
+def test_write_transaction_nonce_too_low_after_retry(
+    provider, client, acc, no_wait
+):
+    client.manager.request_blocking.side_effect = [
+        ethereum.httpx.ReadTimeout('timeout'),
+        ValueError(dict(message='nonce too low')),
+        '0x2',
+    ]
+    Account.objects.filter(pk=acc.pk).update(next_nonce=3)
+
+    txhash = provider.write_transaction(SENDER, b'key', tx())
+    # the first copy may have been mined, it is not broadcast again
+    assert txhash == provider.transaction_hash(
+        mock.Mock(rawTransaction=HexBytes(b'\x03'))
+    )
+    assert client.eth.account.sign_transaction.call_count == 1
+    assert client.manager.request_blocking.call_count == 2
@@ -16,7 +16,8 @@ from django.conf import settings
 
 User = apps.get_model(settings.AUTH_USER_MODEL)
 
-from .models import Account, Blockchain, Transaction
+from . import fake, models
+from .models import Account, Blockchain, Transaction, sender_queue
 
 
 # 2 is a setting that works on a laptop, increase it on CI servers
@@ -63,6 +64,82 @@ def test_fsm_start_finish(acc):
         assert tx.state == state
 
 
+class WatcherProvider(fake.Provider):
+    """Fake provider which supports the djblockchain_watch command."""
+    receipts = dict()
+
+    async def poll_receipts(self, http, txhashes):
+        return '0x10', {txhash: self.receipts.get(txhash) for txhash in txhashes}
+
+    def is_confirmed(self, receipt, block_number):
+        return bool(receipt)
+
+    def watch_receipt(self, transaction, receipt):
+        transaction.gas = receipt['gas']
+
+    def release_nonce(self, sender):
+        pass
+
+
+@pytest.fixture
+def watcher(monkeypatch):
+    monkeypatch.setitem(models.SETTINGS, 'WATCHER', True)
+    bc = Blockchain.objects.create(
+        name='watcher',
+        provider_class='djblockchain.test_models.WatcherProvider',
+    )
+    return User.objects.create().account_set.get_or_create(blockchain=bc)[0]
+
+
+@pytest.mark.django_db
+def test_watcher_sender_queue(watcher):
+    Transaction.objects.bulk_create([
+        Transaction(sender=watcher, state='watch', txhash='0x1'),
+    ])
+    sender_queue(watcher.pk)
+    # left for djblockchain_watch instead of watching in the spooler
+    tx = Transaction.objects.get(txhash='0x1')
+    assert tx.state == 'watch'
+    assert not tx.history
+
+
+@pytest.mark.django_db
+def test_watcher_command(watcher, monkeypatch):
+    pytest.importorskip('web3')
+    from .management.commands.djblockchain_watch import Command
+
+    monkeypatch.setattr(WatcherProvider, 'receipts', {'0x1': dict(gas=1337)})
+    now = int(time.time())
+    Transaction.objects.bulk_create([
+        Transaction(sender=watcher, state='watch', txhash=txhash, history=[
+            ['watch', timestamp],
+        ])
+        for txhash, timestamp in (('0x1', now), ('0x2', now), ('0x3', 0))
+    ])
+
+    Command().tick()
+
+    confirmed = Transaction.objects.get(txhash='0x1')
+    assert confirmed.gas == 1337
+    assert 'postdeploy' in dict(confirmed.history)
+
+    pending = Transaction.objects.get(txhash='0x2')
+    assert pending.state == 'watching'
+    assert not pending.error
+
+    # watch entry is older than RECEIPT_TIMEOUT
+    dropped = Transaction.objects.get(txhash='0x3')
+    assert 'not in chain' in dropped.error
+
+
+def test_watcher_command_requires_watcher():
+    pytest.importorskip('web3')
+    from django.core.management import CommandError, call_command
+
+    with pytest.raises(CommandError):
+        call_command('djblockchain_watch')
+
+
 @pytest.fixture(scope="module")
 def uwsgi():
     uwsgi = subprocess.check_output(['which', 'uwsgi']).decode('utf8').strip()
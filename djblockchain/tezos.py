@@ -13,7 +13,7 @@ from pytezos.rpc.node import RpcError
 from requests.exceptions import ConnectionError
 
 from .models import Account
-from .provider import BaseProvider
+from .provider import BaseProvider, short_args
 
 logger = logging.getLogger('djblockchain.tezos')
 
@@ -181,7 +181,7 @@ class Provider(BaseProvider):
 
     @retry(reraise=True, stop=stop_after_attempt(30))
     def deploy(self, sender, private_key, contract_name, *args, code=None):
-        logger.debug(f'{contract_name}.deploy({args}): start')
+        logger.debug('%s.deploy(%r): start', contract_name, short_args(args))
         client = self.get_client(private_key, reveal=True, sender=sender)
 
         if not client.balance():
@@ -193,7 +193,8 @@ class Provider(BaseProvider):
         tx = dict(code=code, storage=args[0])
         tx = client.origination(tx).autofill().sign()
         result = self.write_transaction(sender, private_key, tx)
-        logger.info(f'{contract_name}.deploy({args}): {result}')
+        logger.info(
+            '%s.deploy(%r): %s', contract_name, short_args(args), result)
         return result
 
     def write_transaction(self, sender, private_key, tx):
@@ -271,14 +272,23 @@ class Provider(BaseProvider):
              contract_address,
              function_name,
              *args):
-        logger.debug(f'{contract_name}.{function_name}({args}): start')
+        logger.debug('%s.%s(%r): start', contract_name, function_name, args)
         client = self.get_client(private_key)
-        logger.debug(f'{contract_name}.{function_name}({args}): counter = {client.account()["counter"]}')
+        if logger.isEnabledFor(logging.DEBUG):
+            # fetching the counter costs an RPC call
+            logger.debug(
+                '%s.%s(%r): counter = %s',
+                contract_name,
+                function_name,
+                args,
+                client.account()['counter'],
+            )
         ci = client.contract(contract_address)
         method = getattr(ci, function_name)
         tx = method(*args)
         result = self.write_transaction(sender, private_key, tx)
-        logger.debug(f'{contract_name}.{function_name}({args}): {result}')
+        logger.debug(
+            '%s.%s(%r): %s', contract_name, function_name, args, result)
         return result
 
     def find_in_past_blocks(self, client, transaction):
@@ -340,11 +350,12 @@ class Provider(BaseProvider):
                 else:
                     raise
 
-        func = transaction.function or 'deploy'
-        sign = (
-            f'{transaction.contract_name}.{func}(*{transaction.args})'
+        logger.debug(
+            '%s.%s(*%r): watch',
+            transaction.contract_name,
+            transaction.function or 'deploy',
+            transaction.args,
         )
-        logger.debug(f'{sign}: watch')
         transaction.gas = opg['contents'][0]['fee']
         result = opg['contents'][0]['metadata']['operation_result']
         if 'originated_contracts' in result:
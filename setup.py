@@ -9,9 +9,16 @@ setup(
         'django-model-utils',
         'cryptography',
         'djcall',
+        'httpx',
         'tenacity',
     ],
     extras_require=dict(
+        fast=[
+            'orjson',
+        ],
+        http2=[
+            'h2',
+        ],
         test=[
             'django',
             'djangorestframework',
@@ -21,6 +28,7 @@ setup(
             'pytest-cov',
             'pytest-django',
             'pytest-asyncio',
+            'web3<6',
         ],
     ),
     author='James Pic',